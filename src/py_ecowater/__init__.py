@@ -1,4 +1,13 @@
 from .ecowater_client import *
 from .model import *
 from .exception import *
+from .collector import *
+from .transport import *
+from .benchmark import *
+from .cassette import *
+from .units import *
+from .subscription import *
+from .registry import *
+from .profiling import *
+from .parsing import *
 from . import constants
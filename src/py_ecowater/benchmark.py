@@ -0,0 +1,307 @@
+import concurrent.futures
+import copy
+import cProfile
+import datetime
+import gzip
+import json
+import logging
+import pstats
+import random
+import threading
+import time
+from typing import Optional, List
+
+from .collector import RequestBudget
+from .ecowater_client import EcowaterClient
+from .model import SystemState
+from .parsing import parse_system_states
+from .transport import Transport, TransportResponse, decode_content
+
+__all__ = [
+    "SYSTEM_STATE_SAMPLE", "synthetic_system_state_payloads", "benchmark_parse", "benchmark_parse_batch",
+    "benchmark_requests", "SyntheticTransport", "profile_system_states",
+]
+
+logger = logging.getLogger("py_ecowater")
+
+# A dashboard response ``data`` dict as returned by the API for a Rheem RHW42
+SYSTEM_STATE_SAMPLE = {
+    "ironLevelTenthsPpm": {"value": 0},
+    "hardnessUnitEnum": {"value": 0},
+    "hardnessGrains": {"value": 11},
+    "saltLevelTenths": {"value": 20, "percent": 25},
+    "saltMonitorEnum": {"value": 1},
+    "volumeUnitEnum": {"value": 0},
+    "regenEnableEnum": {"value": 1},
+    "regenTimeSecs": {"value": 7200},
+    "timeFormatEnum": {"value": 0},
+    "timeZoneEnum": {"value": "America/Denver"},
+    "dateFormatEnum": {"value": 0},
+    "waterShutoffValveReq": {"value": 0},
+    "totalWaterAvailGals": {"value": 2224},
+    "currentWaterFlow": {"value": 0.0},
+    "gallonsUsedToday": {"value": 38},
+    "avgDailyUseGallons": {"value": 90},
+    "regenStatusEnum": {"value": 0},
+    "outOfSaltEstDays": {"value": 130},
+    "daysSinceLastRegen": {"value": 14},
+    "modelId": {"value": 12345},
+    "modelDescription": {"value": "Rheem RHW42"},
+    "systemType": {"value": "demand softener", "type": "softener"},
+    "waterShutoffValve": {"value": 0},
+    "waterShutoffValveInstalled": {"value": 1},
+    "waterShutoffValveOverride": {"value": 0},
+    "waterShutoffValveDeviceAction": {"value": 0},
+    "wsovErrorCode": {"value": 0},
+    "baseSoftwareVersion": {"value": "r4.4 MPC01082"},
+    "power": "Online",
+    "deviceDate": "2023-07-29T09:44:38.149Z",
+    "refreshPolicy": {"delay": "low", "time": 300000},
+}
+
+
+def synthetic_system_state_payloads(count: int, seed: int = 0) -> List[dict]:
+    """Generate dashboard ``data`` dicts shaped like `SYSTEM_STATE_SAMPLE` with varying usage values.
+    Parameters
+    ----------
+    count : `int`
+        The number of payloads to generate.
+    seed : `int`
+        The random seed, so that runs are reproducible.
+    """
+    rand = random.Random(seed)
+    device_date = datetime.datetime(2023, 7, 29, 9, 44, 38, 149000)
+    payloads = []
+
+    for i in range(count):
+        payload = copy.deepcopy(SYSTEM_STATE_SAMPLE)
+        payload["saltLevelTenths"] = {"value": rand.randint(0, 80), "percent": rand.randint(0, 100)}
+        payload["totalWaterAvailGals"]["value"] = rand.randint(0, 3000)
+        payload["currentWaterFlow"]["value"] = round(rand.uniform(0, 5), 1)
+        payload["gallonsUsedToday"]["value"] = rand.randint(0, 300)
+        payload["outOfSaltEstDays"]["value"] = rand.randint(0, 200)
+        payload["daysSinceLastRegen"]["value"] = rand.randint(0, 30)
+        payload["deviceDate"] = (device_date + datetime.timedelta(seconds=i)).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+        payloads.append(payload)
+
+    return payloads
+
+
+def _percentile(sorted_values: List[float], percent: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+
+    index = min(int(round(percent / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def _summarize(name: str, durations: List[float], errors: int = 0) -> dict:
+    durations = sorted(durations)
+    total = sum(durations)
+
+    return {
+        "benchmark": name,
+        "iterations": len(durations) + errors,
+        "errors": errors,
+        "total_seconds": total,
+        "per_second": len(durations) / total if total else None,
+        "mean_ms": total / len(durations) * 1000 if durations else None,
+        "min_ms": durations[0] * 1000 if durations else None,
+        "p50_ms": _percentile(durations, 50) * 1000 if durations else None,
+        "p90_ms": _percentile(durations, 90) * 1000 if durations else None,
+        "p99_ms": _percentile(durations, 99) * 1000 if durations else None,
+        "max_ms": durations[-1] * 1000 if durations else None,
+    }
+
+
+def benchmark_parse(iterations: int = 1000, seed: int = 0) -> dict:
+    """Time building a `SystemState` from synthetic dashboard payloads.
+    Parameters
+    ----------
+    iterations : `int`
+        The number of payloads to parse.
+    seed : `int`
+        The random seed for the synthetic payloads.
+    """
+    payloads = synthetic_system_state_payloads(iterations, seed)
+    durations = []
+
+    for payload in payloads:
+        start = time.perf_counter()
+        SystemState(api=payload)
+        durations.append(time.perf_counter() - start)
+
+    return _summarize("parse", durations)
+
+
+def benchmark_parse_batch(iterations: int = 1000, max_workers: Optional[int] = None, use_processes: bool = False,
+                          chunk_size: int = 32, seed: int = 0) -> dict:
+    """Time decoding and building a batch of `SystemState` objects from raw JSON dashboard responses on a thread or
+    process pool with `parse_system_states`.
+    Parameters
+    ----------
+    iterations : `int`
+        The number of payloads in the batch.
+    max_workers : `int`
+        The number of workers of the pool.
+    use_processes : `bool`
+        Whether to parse on a process pool rather than a thread pool.
+    chunk_size : `int`
+        The number of payloads handed to a worker at a time.
+    seed : `int`
+        The random seed for the synthetic payloads.
+    """
+    payloads = [json.dumps({"data": payload}).encode() for payload in synthetic_system_state_payloads(iterations, seed)]
+    pool_class = concurrent.futures.ProcessPoolExecutor if use_processes else concurrent.futures.ThreadPoolExecutor
+
+    with pool_class(max_workers=max_workers) as pool:
+        # Start the workers before timing
+        parse_system_states(payloads[:1], executor=pool)
+
+        start = time.perf_counter()
+        parse_system_states(payloads, executor=pool, chunk_size=chunk_size)
+        total_seconds = time.perf_counter() - start
+
+    return {
+        "benchmark": "parse-batch",
+        "iterations": iterations,
+        "pool": "process" if use_processes else "thread",
+        "max_workers": max_workers,
+        "chunk_size": chunk_size,
+        "total_seconds": total_seconds,
+        "per_second": iterations / total_seconds if total_seconds else None,
+    }
+
+
+def benchmark_requests(client: EcowaterClient, serial_number: Optional[str] = None, iterations: int = 10,
+                       budget: Optional[RequestBudget] = None) -> dict:
+    """Time fetching the system state of one system through a client, including transport and parsing. Point the
+    client's host at a local stand-in for the API to avoid spending the account's request budget, or pass a budget to
+    stop early rather than exceed it.
+    Parameters
+    ----------
+    client : `EcowaterClient`
+        The client to send requests with.
+    serial_number : `str`
+        The system to fetch. Defaults to the first system on the account.
+    iterations : `int`
+        The number of requests to time.
+    budget : `RequestBudget`
+        The request budget of the account, charged for every request.
+    """
+    if not serial_number:
+        if budget and not budget.try_acquire():
+            logger.error("Request budget exhausted for %s, not benchmarking requests", client.username)
+            return _summarize("request", [], iterations)
+        systems = client.get_systems()
+        if not systems or not systems.systems:
+            logger.error("No systems found to benchmark requests against")
+            return _summarize("request", [], iterations)
+        serial_number = systems.systems[0].serial_number
+
+    durations = []
+    errors = 0
+
+    for i in range(iterations):
+        if budget and not budget.try_acquire():
+            logger.warning("Request budget exhausted for %s, stopping after %s requests", client.username, i)
+            break
+
+        start = time.perf_counter()
+        system_state = client.get_system_state(serial_number)
+        elapsed = time.perf_counter() - start
+
+        if system_state:
+            durations.append(elapsed)
+        else:
+            errors += 1
+
+    return _summarize("request", durations, errors)
+
+
+class SyntheticTransport(Transport):
+    """Serves sign-in responses and the given dashboard payloads from memory, gzip compressed like the API responses,
+    so that the full request path can be measured without a network.
+    Parameters
+    ----------
+    payloads : `list`
+        Dashboard ``data`` dicts, served in order and starting over when they run out.
+    """
+
+    def __init__(self, payloads: List[dict]):
+        super().__init__()
+        auth_response = {"data": {"token": "synthetic", "expiresIn": 86400000}}
+        self.__auth_body: bytes = gzip.compress(json.dumps(auth_response).encode())
+        self.__bodies: List[bytes] = [gzip.compress(json.dumps({"data": payload}).encode()) for payload in payloads]
+        self.__position: int = 0
+        self.__lock: threading.Lock = threading.Lock()
+
+    def request(self, method: str, url: str, headers: dict, json: Optional[dict] = None) -> TransportResponse:
+        if method == "POST":
+            body = self.__auth_body
+        else:
+            with self.__lock:
+                body = self.__bodies[self.__position % len(self.__bodies)]
+                self.__position += 1
+
+        response = TransportResponse(200, "OK", {"content-encoding": "gzip"}, decode_content(body, "gzip"), len(body))
+        self.stats.record(response)
+        return response
+
+
+def profile_system_states(iterations: int = 1000, pstats_output: Optional[str] = None, top: int = 25,
+                          seed: int = 0) -> dict:
+    """Run synthetic dashboard payloads through the full `get_system_state` path and report how long each stage took
+    along with the functions that took the most time under cProfile. The stages are timed in a separate pass from the
+    profiled one, so that profiling overhead does not skew them.
+    Parameters
+    ----------
+    iterations : `int`
+        The number of system states to fetch in each pass.
+    pstats_output : `str`
+        A file to write the cProfile stats to, for use with `pstats` or a flame graph tool such as snakeviz.
+    top : `int`
+        The number of functions to report, by cumulative time.
+    seed : `int`
+        The random seed for the synthetic payloads.
+    """
+    payloads = synthetic_system_state_payloads(min(iterations, 1000), seed)
+
+    client = EcowaterClient("profile", "profile", transport=SyntheticTransport(payloads), profile=True)
+    client.get_system_state("SL0")
+    client.timings.reset()
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        client.get_system_state("SL0")
+    total_seconds = time.perf_counter() - start
+    stages = client.timings.summary()
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    for _ in range(iterations):
+        client.get_system_state("SL0")
+    profiler.disable()
+
+    if pstats_output:
+        profiler.dump_stats(pstats_output)
+
+    stats = pstats.Stats(profiler)
+    functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+
+    return {
+        "benchmark": "profile",
+        "iterations": iterations,
+        "total_seconds": total_seconds,
+        "per_second": iterations / total_seconds if total_seconds else None,
+        "stages": stages,
+        "top_functions": [
+            {
+                "function": f"{filename}:{line}({name})",
+                "calls": calls,
+                "total_seconds": total_time,
+                "cumulative_seconds": cumulative_time,
+            }
+            for (filename, line, name), (_, calls, total_time, cumulative_time, _) in functions
+        ],
+    }
@@ -0,0 +1,172 @@
+import base64
+import collections
+import gzip
+import json
+import logging
+import threading
+import time
+from typing import Optional, List, Dict, Tuple
+from urllib.parse import urlsplit
+
+from . import constants
+from .transport import Transport, TransportResponse, RequestsTransport
+
+__all__ = ["RecordingTransport", "ReplayTransport"]
+
+logger = logging.getLogger("py_ecowater")
+
+# Bodies are recorded decoded, so the headers describing the encoded body no longer apply
+_UNRECORDED_HEADERS = ("set-cookie", "content-encoding", "content-length")
+
+_API_VERSION = constants.ECOWATER_PATH_AUTH.split("/")[0]
+
+
+def _json_dumps(obj) -> str:
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def _open_cassette(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _api_path(path: str) -> str:
+    # Drop any path prefix of a base URL host, such as api/ for http://localhost:8080/api, up to the API version
+    segments = path.lstrip("/").split("/")
+    if _API_VERSION in segments:
+        segments = segments[segments.index(_API_VERSION):]
+    return "/".join(segments)
+
+
+def _request_key(method: str, url: str) -> Tuple[str, str]:
+    # Key on the API path only, so that a cassette recorded against one host or base URL can be replayed against any
+    # other
+    return method.upper(), _api_path(urlsplit(url).path)
+
+
+class RecordingTransport(Transport):
+    """Sends requests through another transport and appends each request and response to a cassette file as JSON
+    Lines, gzip compressed if the path ends in ``.gz``. Request headers and bodies are not recorded, so credentials
+    never reach the cassette, and the token in sign-in responses is replaced.
+    Parameters
+    ----------
+    path : `str`
+        The cassette file to append to.
+    transport : `Transport`
+        The transport to send requests with. Defaults to a `RequestsTransport`.
+    """
+
+    def __init__(self, path: str, transport: Optional[Transport] = None):
+        super().__init__()
+        self.path: str = path
+        self.transport: Transport = transport if transport else RequestsTransport()
+        self.accept_encoding = self.transport.accept_encoding
+        self.__file = _open_cassette(path, "a")
+        self.__lock: threading.Lock = threading.Lock()
+
+    def request(self, method: str, url: str, headers: dict, json: Optional[dict] = None) -> TransportResponse:
+        start = time.monotonic()
+        response = self.transport.request(method, url, headers, json=json)
+        elapsed = time.monotonic() - start
+
+        method, path = _request_key(method, url)
+        content = response.content
+        if path == constants.ECOWATER_PATH_AUTH:
+            content = self.__redact_token(content)
+
+        interaction = {
+            "elapsed": elapsed,
+            "method": method,
+            "path": path,
+            "status_code": response.status_code,
+            "reason": response.reason,
+            "headers": {k: v for k, v in response.headers.items() if k not in _UNRECORDED_HEADERS},
+            "wire_bytes": response.wire_bytes,
+            "http_version": response.http_version,
+        }
+        try:
+            interaction["body"] = content.decode("utf-8")
+        except UnicodeDecodeError:
+            interaction["body_base64"] = base64.b64encode(content).decode("ascii")
+
+        with self.__lock:
+            self.__file.write(_json_dumps(interaction) + "\n")
+            self.__file.flush()
+
+        self.stats.record(response)
+        return response
+
+    @staticmethod
+    def __redact_token(content: bytes) -> bytes:
+        try:
+            auth_response = json.loads(content)
+            auth_response["data"]["token"] = "recorded-token"
+            return _json_dumps(auth_response).encode("utf-8")
+        except Exception:
+            return content
+
+    def close(self):
+        with self.__lock:
+            self.__file.close()
+        self.transport.close()
+
+
+class ReplayTransport(Transport):
+    """Replays the responses in a cassette written by `RecordingTransport` without touching the network. Requests are
+    matched on method and path, and each path's responses are replayed in the order they were recorded, starting over
+    when they run out so that benchmarks can run longer than the recording.
+    Parameters
+    ----------
+    path : `str`
+        The cassette file to replay.
+    speed : `float`
+        How fast to replay the recorded response times, for example 1 for the recorded latency or 10 for ten times
+        faster. Defaults to None, which replays responses without any delay.
+    """
+
+    def __init__(self, path: str, speed: Optional[float] = None):
+        super().__init__()
+        self.path: str = path
+        self.speed: Optional[float] = speed
+        self.__interactions: Dict[Tuple[str, str], List[dict]] = collections.defaultdict(list)
+        self.__positions: Dict[Tuple[str, str], int] = collections.defaultdict(int)
+        self.__lock: threading.Lock = threading.Lock()
+
+        with _open_cassette(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    interaction = json.loads(line)
+                    key = (interaction["method"], _api_path(interaction["path"]))
+                    self.__interactions[key].append(interaction)
+
+    def request(self, method: str, url: str, headers: dict, json: Optional[dict] = None) -> TransportResponse:
+        key = _request_key(method, url)
+
+        with self.__lock:
+            interactions = self.__interactions.get(key)
+            if not interactions:
+                logger.error("No recorded response for %s %s in %s", key[0], key[1], self.path)
+                return TransportResponse(404, "Not Recorded", {}, b"", 0)
+
+            interaction = interactions[self.__positions[key] % len(interactions)]
+            self.__positions[key] += 1
+
+        if self.speed:
+            time.sleep(interaction["elapsed"] / self.speed)
+
+        if "body" in interaction:
+            content = interaction["body"].encode("utf-8")
+        else:
+            content = base64.b64decode(interaction["body_base64"])
+
+        response = TransportResponse(
+            status_code=interaction["status_code"],
+            reason=interaction["reason"],
+            headers=interaction["headers"],
+            content=content,
+            wire_bytes=interaction["wire_bytes"],
+            http_version=interaction["http_version"]
+        )
+        self.stats.record(response)
+        return response
@@ -0,0 +1,195 @@
+import argparse
+import datetime
+import enum
+import json
+import logging
+import os
+import sys
+import time
+from typing import Optional, List, Dict
+
+from . import constants
+from .benchmark import benchmark_parse, benchmark_parse_batch, benchmark_requests, profile_system_states
+from .collector import RequestBudget
+from .ecowater_client import EcowaterClient
+from .model import Systems
+
+logger = logging.getLogger("py_ecowater")
+
+
+def _to_json(obj):
+    """Convert a model object into JSON-serializable python values."""
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if isinstance(obj, enum.Enum):
+        return obj.value
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, dict):
+        return {str(k): _to_json(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple, set)):
+        return [_to_json(v) for v in obj]
+    if hasattr(obj, "__dict__"):
+        return {k: _to_json(v) for k, v in vars(obj).items() if not k.startswith("_")}
+    return str(obj)
+
+
+def _write(record: dict, out=None):
+    out = out if out else sys.stdout
+    out.write(json.dumps(_to_json(record)) + "\n")
+    out.flush()
+
+
+def _load_accounts(args) -> List[Dict[str, str]]:
+    accounts = []
+
+    for account in args.account or []:
+        username, _, password = account.partition(":")
+        accounts.append({"username": username, "password": password})
+
+    if args.accounts_file:
+        with open(args.accounts_file) as f:
+            for line in f:
+                if line.strip():
+                    accounts.append(json.loads(line))
+
+    if not accounts and os.getenv("ECOWATER_USERNAME"):
+        accounts.append({"username": os.getenv("ECOWATER_USERNAME"), "password": os.getenv("ECOWATER_PASSWORD", "")})
+
+    return accounts
+
+
+def _clients(args) -> List[EcowaterClient]:
+    accounts = _load_accounts(args)
+    if not accounts:
+        raise SystemExit("No accounts given, use --account, --accounts-file or ECOWATER_USERNAME/ECOWATER_PASSWORD")
+
+    return [EcowaterClient(a["username"], a["password"], host=a["host"] if "host" in a else args.host)
+            for a in accounts]
+
+
+def _snapshot(client: EcowaterClient, systems: Optional[Systems], budget: Optional[RequestBudget] = None):
+    if not systems:
+        return
+
+    for system in systems.systems:
+        if budget and not budget.try_acquire():
+            logger.warning("Request budget exhausted for %s, skipping %s", client.username, system.serial_number)
+            continue
+
+        _write({"type": "system_state", "account": client.username, "serial_number": system.serial_number,
+                "time": time.time(), "system_state": client.get_system_state(system.serial_number)})
+
+
+def snapshot(args):
+    for client in _clients(args):
+        systems = client.get_systems()
+        _write({"type": "devices", "account": client.username, "time": time.time(), "devices": client.devices})
+        _write({"type": "systems", "account": client.username, "time": time.time(), "systems": systems})
+        _snapshot(client, systems)
+
+
+def _discover(client: EcowaterClient, budget: RequestBudget) -> Optional[Systems]:
+    if not budget.try_acquire():
+        logger.warning("Request budget exhausted for %s, not fetching its systems", client.username)
+        return None
+
+    systems = client.get_systems()
+    if not systems:
+        logger.warning("Unable to fetch the systems of %s, retrying on the next poll", client.username)
+        return None
+
+    return systems
+
+
+def poll(args):
+    clients = _clients(args)
+    budgets = {client.username: RequestBudget() for client in clients}
+    systems: Dict[str, Systems] = {}
+    next_discovery = {client.username: 0.0 for client in clients}
+    count = 0
+
+    while not args.count or count < args.count:
+        start = time.monotonic()
+        for client in clients:
+            # The systems of an account rarely change, so only fetch them again every discovery interval, or on the
+            # next poll if fetching them failed
+            if start >= next_discovery[client.username]:
+                discovered = _discover(client, budgets[client.username])
+                if discovered:
+                    systems[client.username] = discovered
+                    next_discovery[client.username] = start + args.discovery_interval
+
+            if client.username not in systems:
+                logger.warning("No systems known for %s, skipping this poll", client.username)
+                continue
+
+            _snapshot(client, systems[client.username], budgets[client.username])
+
+        count += 1
+        if not args.count or count < args.count:
+            time.sleep(max(args.interval - (time.monotonic() - start), 0))
+
+
+def bench(args):
+    if args.benchmark == "parse":
+        _write(benchmark_parse(args.iterations or 1000))
+    elif args.benchmark == "parse-batch":
+        _write(benchmark_parse_batch(args.iterations or 1000, args.workers, args.processes))
+    elif args.benchmark == "profile":
+        _write(profile_system_states(args.iterations or 1000, args.pstats_output))
+    else:
+        for client in _clients(args):
+            # Requests to the real API count against the account's rate limit. The budget only sees this run's requests,
+            # so it caps the run at the limit rather than tracking the account's usage
+            budget = RequestBudget() if client.ecowater_constants.host == constants.ECOWATER_HOST else None
+            result = benchmark_requests(client, args.serial_number, args.iterations or 10, budget)
+            result["account"] = client.username
+            result["host"] = client.ecowater_constants.host
+            _write(result)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="py-ecowater", description="Fetch device data from the Ecowater API")
+    parser.add_argument("--account", action="append", metavar="USERNAME:PASSWORD",
+                        help="an account to use, may be given more than once")
+    parser.add_argument("--accounts-file", help="a JSON Lines file of {\"username\", \"password\", \"host\"} objects")
+    parser.add_argument("--host", help="the API host or base URL, such as http://localhost:8080 for a local stand-in")
+    parser.add_argument("--log-level", default="WARNING")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    snapshot_parser = subparsers.add_parser("snapshot", help="write devices, systems and system states as JSON Lines")
+    snapshot_parser.set_defaults(func=snapshot)
+
+    poll_parser = subparsers.add_parser("poll", help="poll system states and stream them as JSON Lines")
+    poll_parser.add_argument("--interval", type=float, default=300, help="seconds between polls")
+    poll_parser.add_argument("--count", type=int, default=0, help="number of polls, 0 polls forever")
+    poll_parser.add_argument("--discovery-interval", type=float, default=constants.ECOWATER_RATE_LIMIT_WINDOW_SECONDS,
+                             help="seconds between fetching the systems of each account again")
+    poll_parser.set_defaults(func=poll)
+
+    bench_parser = subparsers.add_parser("bench", help="run a benchmark and write the results as JSON")
+    bench_parser.add_argument("benchmark", choices=["parse", "parse-batch", "request", "profile"])
+    bench_parser.add_argument("--iterations", type=int,
+                              help="the number of iterations, defaults to 10 for the request benchmark and 1000 for "
+                                   "the others")
+    bench_parser.add_argument("--serial-number", help="the system to request, defaults to the first system")
+    bench_parser.add_argument("--pstats-output", help="a file to write the cProfile stats of the profile benchmark to")
+    bench_parser.add_argument("--workers", type=int, help="the number of pool workers for the parse-batch benchmark")
+    bench_parser.add_argument("--processes", action="store_true",
+                              help="parse on a process pool rather than a thread pool in the parse-batch benchmark")
+    bench_parser.set_defaults(func=bench)
+
+    args = parser.parse_args(argv)
+
+    date_strftime_format = "%y-%b-%d %H:%M:%S"
+    message_format = "%(asctime)s - %(levelname)s - %(message)s"
+    logging.basicConfig(format=message_format, datefmt=date_strftime_format, stream=sys.stderr,
+                        level=args.log_level.upper())
+
+    try:
+        args.func(args)
+    except KeyboardInterrupt:
+        pass
+
+    return 0
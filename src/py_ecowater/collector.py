@@ -0,0 +1,406 @@
+import collections
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+from typing import Optional, List, Dict, Set, Tuple
+
+from . import constants
+from .ecowater_client import EcowaterClient
+from .model import SystemState
+
+__all__ = ["RequestBudget", "EcowaterCollector", "EcowaterCollectorClient"]
+
+logger = logging.getLogger("py_ecowater")
+
+
+class RequestBudget(object):
+    """A sliding window request budget, used to keep an account under the Ecowater API rate limit.
+    Parameters
+    ----------
+    max_requests : `int`
+        The number of requests allowed within the window.
+    window_seconds : `float`
+        The length of the window in seconds.
+    """
+
+    def __init__(self, max_requests: int = constants.ECOWATER_RATE_LIMIT_REQUESTS,
+                 window_seconds: float = constants.ECOWATER_RATE_LIMIT_WINDOW_SECONDS):
+        self.max_requests: int = max_requests
+        self.window_seconds: float = window_seconds
+        self.__requests: collections.deque = collections.deque()
+        self.__lock: threading.Lock = threading.Lock()
+
+    def __expire(self, now: float):
+        while self.__requests and self.__requests[0] <= now - self.window_seconds:
+            self.__requests.popleft()
+
+    def remaining(self) -> int:
+        with self.__lock:
+            self.__expire(time.monotonic())
+            return self.max_requests - len(self.__requests)
+
+    def seconds_until_available(self) -> float:
+        """Returns how long until the budget allows another request, 0 if it allows one now."""
+        with self.__lock:
+            now = time.monotonic()
+            self.__expire(now)
+
+            if len(self.__requests) < self.max_requests:
+                return 0
+            return self.__requests[0] + self.window_seconds - now
+
+    def try_acquire(self) -> bool:
+        """Record a request if the budget allows it. Returns False if the budget is exhausted."""
+        with self.__lock:
+            now = time.monotonic()
+            self.__expire(now)
+
+            if len(self.__requests) >= self.max_requests:
+                return False
+
+            self.__requests.append(now)
+            return True
+
+
+class EcowaterCollector(object):
+    """A coordinator that owns the Ecowater connections for one or more accounts, polls the system state of every
+    system on those accounts within each account's request budget, and serves the latest snapshots to other processes
+    over a Unix socket. Worker processes read the snapshots with `EcowaterCollectorClient`, so adding workers does not
+    add upstream requests.
+    Parameters
+    ----------
+    clients : `list`
+        The `EcowaterClient` objects to poll, one per account.
+    socket_path : `str`
+        The path of the Unix socket to serve snapshots on.
+    poll_interval_seconds : `float`
+        How often to poll each system. Defaults to the fastest interval the account's request budget allows, keeping
+        ``ECOWATER_RATE_LIMIT_HEADROOM`` of it free for signing in and discovering systems.
+    discovery_interval_seconds : `float`
+        How often to fetch the systems of each account again, to pick up systems that were added or removed.
+    """
+
+    def __init__(self, clients: List[EcowaterClient], socket_path: str = constants.ECOWATER_COLLECTOR_SOCKET_PATH,
+                 poll_interval_seconds: Optional[float] = None,
+                 discovery_interval_seconds: float = constants.ECOWATER_RATE_LIMIT_WINDOW_SECONDS):
+        self.clients: List[EcowaterClient] = clients
+        self.socket_path: str = socket_path
+        self.poll_interval_seconds: Optional[float] = poll_interval_seconds
+        self.discovery_interval_seconds: float = discovery_interval_seconds
+        self.__next_discovery: float = 0
+        self.budgets: Dict[str, RequestBudget] = {client.username: RequestBudget() for client in clients}
+        self.__serial_numbers: Dict[str, EcowaterClient] = {}
+        self.__next_poll: Dict[str, float] = {}
+        self.__snapshots: Dict[str, Tuple[dict, float]] = {}
+        self.__lock: threading.Lock = threading.Lock()
+        self.__stopped: threading.Event = threading.Event()
+        self.__server: Optional[socketserver.UnixStreamServer] = None
+        self.__connections: Set[socket.socket] = set()
+        self.__threads: List[threading.Thread] = []
+
+    def get_serial_numbers(self) -> List[str]:
+        with self.__lock:
+            return list(self.__serial_numbers.keys())
+
+    def get_snapshot(self, serial_number: str) -> Optional[Tuple[dict, float]]:
+        """Returns the latest system state data for a system and the time it was fetched, or None if it has not been
+        fetched yet."""
+        with self.__lock:
+            return self.__snapshots.get(serial_number)
+
+    def discover(self):
+        """Fetch the systems for every account, start tracking systems that were added and stop tracking systems that
+        were removed."""
+        retry_seconds = 0
+
+        for client in self.clients:
+            budget = self.budgets[client.username]
+            if not budget.try_acquire():
+                logger.warning("Request budget exhausted for %s, delaying system discovery", client.username)
+                retry_seconds = max(retry_seconds, budget.seconds_until_available())
+                continue
+
+            systems = client.get_systems()
+            if not systems:
+                continue
+
+            serial_numbers = {system.serial_number for system in systems.systems if system.serial_number}
+
+            with self.__lock:
+                for serial_number in [s for s, c in self.__serial_numbers.items() if c is client]:
+                    if serial_number not in serial_numbers:
+                        del self.__serial_numbers[serial_number]
+                        del self.__next_poll[serial_number]
+                        self.__snapshots.pop(serial_number, None)
+
+                for serial_number in serial_numbers:
+                    self.__serial_numbers[serial_number] = client
+                    self.__next_poll.setdefault(serial_number, 0)
+
+        self.__next_discovery = time.monotonic() + (retry_seconds if retry_seconds else self.discovery_interval_seconds)
+
+    def __get_poll_interval(self, client: EcowaterClient) -> float:
+        if self.poll_interval_seconds:
+            return self.poll_interval_seconds
+
+        budget = self.budgets[client.username]
+        system_count = sum(1 for c in self.__serial_numbers.values() if c is client)
+        polls_per_window = budget.max_requests * (1 - constants.ECOWATER_RATE_LIMIT_HEADROOM)
+        return budget.window_seconds / polls_per_window * max(system_count, 1)
+
+    def poll(self):
+        """Poll every system that is due, within the request budget of its account."""
+        with self.__lock:
+            now = time.monotonic()
+            due = [(serial_number, client) for serial_number, client in self.__serial_numbers.items()
+                   if self.__next_poll[serial_number] <= now]
+
+        for serial_number, client in due:
+            budget = self.budgets[client.username]
+            if not budget.try_acquire():
+                retry_seconds = budget.seconds_until_available()
+                logger.warning("Request budget exhausted for %s, delaying poll of %s by %s seconds", client.username,
+                               serial_number, retry_seconds)
+                with self.__lock:
+                    if serial_number in self.__next_poll:
+                        self.__next_poll[serial_number] = time.monotonic() + max(retry_seconds, 1)
+                continue
+
+            data = client.get_system_state_data(serial_number)
+
+            with self.__lock:
+                if serial_number not in self.__next_poll:
+                    continue
+
+                self.__next_poll[serial_number] = time.monotonic() + self.__get_poll_interval(client)
+                if data:
+                    self.__snapshots[serial_number] = (data, time.time())
+
+    def __poll_forever(self):
+        while not self.__stopped.is_set():
+            try:
+                if time.monotonic() >= self.__next_discovery:
+                    self.discover()
+                self.poll()
+            except Exception as e:
+                logger.error("Unexpected error while polling systems: %s", e)
+
+            with self.__lock:
+                next_poll = min(self.__next_poll.values(), default=self.__next_discovery)
+            next_wake = min(next_poll, self.__next_discovery)
+            self.__stopped.wait(max(next_wake - time.monotonic(), 1))
+
+    def start(self):
+        """Discover systems, start polling them and start serving snapshots on the Unix socket."""
+        self.discover()
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        collector = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                if not collector._add_connection(self.connection):
+                    return
+
+                try:
+                    for line in self.rfile:
+                        self.wfile.write(collector._handle_request(line))
+                        self.wfile.flush()
+                finally:
+                    collector._remove_connection(self.connection)
+
+        self.__stopped.clear()
+        self.__server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        self.__server.daemon_threads = True
+        self.__threads = [
+            threading.Thread(target=self.__poll_forever, name="py_ecowater-collector-poll", daemon=True),
+            threading.Thread(target=self.__server.serve_forever, name="py_ecowater-collector-serve", daemon=True),
+        ]
+        for thread in self.__threads:
+            thread.start()
+
+    def stop(self):
+        """Stop polling, stop accepting connections and close the connections of running `EcowaterCollectorClient`s, so
+        that they do not keep reading snapshots that are no longer updated."""
+        self.__stopped.set()
+
+        if self.__server:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__server = None
+
+        with self.__lock:
+            connections = list(self.__connections)
+            self.__connections.clear()
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+        for thread in self.__threads:
+            thread.join()
+        self.__threads = []
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def _add_connection(self, connection: socket.socket) -> bool:
+        with self.__lock:
+            if self.__stopped.is_set():
+                return False
+            self.__connections.add(connection)
+            return True
+
+    def _remove_connection(self, connection: socket.socket):
+        with self.__lock:
+            self.__connections.discard(connection)
+
+    def _handle_request(self, line: bytes) -> bytes:
+        try:
+            request = json.loads(line)
+        except Exception as e:
+            logger.error("Could not parse collector request: %s. %s", line, e)
+            return b'{"error": "invalid request"}\n'
+
+        op = request["op"] if "op" in request else None
+
+        if op == "list":
+            response = {"serial_numbers": self.get_serial_numbers()}
+        elif op == "get":
+            snapshot = self.get_snapshot(request["serial_number"]) if "serial_number" in request else None
+            if not snapshot:
+                response = {"data": None, "updated": None}
+            elif "since" in request and request["since"] == snapshot[1]:
+                response = {"unchanged": True, "updated": snapshot[1]}
+            else:
+                response = {"data": snapshot[0], "updated": snapshot[1]}
+        else:
+            response = {"error": f"unknown op {op}"}
+
+        return json.dumps(response).encode() + b"\n"
+
+
+class EcowaterCollectorClient(object):
+    """Reads system state snapshots from an `EcowaterCollector` running in another process. It mirrors the
+    `EcowaterClient` methods for system state but never calls the Ecowater API itself, and reuses the `SystemState`
+    it built last when the snapshot has not changed.
+    Parameters
+    ----------
+    socket_path : `str`
+        The path of the Unix socket the collector serves snapshots on.
+    """
+
+    def __init__(self, socket_path: str = constants.ECOWATER_COLLECTOR_SOCKET_PATH):
+        self.socket_path: str = socket_path
+        self.__socket: Optional[socket.socket] = None
+        self.__file = None
+        self.__states: Dict[str, Tuple[SystemState, float]] = {}
+        self.__updated: Dict[str, float] = {}
+        self.__lock: threading.Lock = threading.Lock()
+
+    def __request(self, request: dict) -> Optional[dict]:
+        with self.__lock:
+            for attempt in range(2):
+                try:
+                    if not self.__socket:
+                        self.__socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                        self.__socket.connect(self.socket_path)
+                        self.__file = self.__socket.makefile("rwb")
+
+                    self.__file.write(json.dumps(request).encode() + b"\n")
+                    self.__file.flush()
+                    line = self.__file.readline()
+                    if not line:
+                        raise ConnectionError("collector closed the connection")
+                    return json.loads(line)
+                except Exception as e:
+                    self.close()
+                    if attempt:
+                        logger.error("Unable to read from collector at %s: %s", self.socket_path, e)
+
+        return None
+
+    def close(self):
+        if self.__file:
+            try:
+                self.__file.close()
+            except OSError:
+                pass
+            self.__file = None
+
+        if self.__socket:
+            self.__socket.close()
+            self.__socket = None
+
+    def get_serial_numbers(self) -> List[str]:
+        response = self.__request({"op": "list"})
+        return response["serial_numbers"] if response and "serial_numbers" in response else []
+
+    def get_updated(self, serial_number: str) -> Optional[float]:
+        """Returns the time the collector fetched the snapshot last returned for a system, or None if none was
+        returned yet."""
+        return self.__updated.get(serial_number)
+
+    def __is_stale(self, serial_number: str, updated: float, max_age_seconds: Optional[float]) -> bool:
+        self.__updated[serial_number] = updated
+        age = time.time() - updated
+        if max_age_seconds is not None and age > max_age_seconds:
+            logger.warning("The collector's snapshot of %s is %s seconds old", serial_number, round(age))
+            return True
+        return False
+
+    def get_system_state_data(self, serial_number: str, max_age_seconds: Optional[float] = None) -> Optional[dict]:
+        """Returns the latest system state data the collector fetched for a system.
+        Parameters
+        ----------
+        serial_number : `str`
+            The system to read.
+        max_age_seconds : `float`
+            Return None rather than a snapshot fetched longer ago than this, for example because the collector stopped
+            polling or ran out of request budget. Defaults to returning any snapshot.
+        """
+        response = self.__request({"op": "get", "serial_number": serial_number})
+        if not response or "data" not in response or not response["data"]:
+            return None
+
+        if self.__is_stale(serial_number, response["updated"], max_age_seconds):
+            return None
+
+        return response["data"]
+
+    def get_system_state(self, serial_number: str, max_age_seconds: Optional[float] = None) -> Optional[SystemState]:
+        """Returns the latest system state the collector fetched for a system. Use `get_updated` for the time it was
+        fetched.
+        Parameters
+        ----------
+        serial_number : `str`
+            The system to read.
+        max_age_seconds : `float`
+            Return None rather than a snapshot fetched longer ago than this, for example because the collector stopped
+            polling or ran out of request budget. Defaults to returning any snapshot.
+        """
+        request = {"op": "get", "serial_number": serial_number}
+        cached = self.__states.get(serial_number)
+        if cached:
+            request["since"] = cached[1]
+
+        response = self.__request(request)
+        if not response:
+            return None
+
+        if "unchanged" in response and response["unchanged"]:
+            return None if self.__is_stale(serial_number, cached[1], max_age_seconds) else cached[0]
+
+        if "data" not in response or not response["data"]:
+            return None
+
+        system_state = SystemState(api=response["data"])
+        self.__states[serial_number] = (system_state, response["updated"])
+        return None if self.__is_stale(serial_number, response["updated"], max_age_seconds) else system_state
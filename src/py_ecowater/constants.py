@@ -1,3 +1,5 @@
+from urllib.parse import urlsplit
+
 ECOWATER_HOST = "apioem.ecowater.com"
 ECOWATER_PATH_AUTH = "v1/auth/signin"
 ECOWATER_PATH_USER_PROFILE = "v1/user/profile"
@@ -17,8 +19,22 @@ class EcowaterConstants(object):
     def __init__(self, host=ECOWATER_HOST):
         self.host = host if host else ECOWATER_HOST
         self.uri_base = f"https://{self.host}/"
+        if "://" in self.host:
+            # A full base URL, such as a local stand-in for the API at http://localhost:8080
+            self.uri_base = f"{self.host.rstrip('/')}/"
+            self.host = urlsplit(self.host).netloc
         self.headers_api = ECOWATER_HEADERS.copy()
         self.headers_api["host"] = self.host
         self.headers_auth = ECOWATER_HEADERS.copy()
         self.headers_auth["content-type"] = "application/json;charset=utf-8"
         self.auth_expiry_buffer_minutes = 10
+        self.auth_refresh_jitter_minutes = 5
+        self.auth_refresh_retry_seconds = 60
+
+# The Ecowater API allows 250 requests per account over a 6 hour window
+ECOWATER_RATE_LIMIT_REQUESTS = 250
+ECOWATER_RATE_LIMIT_WINDOW_SECONDS = 6 * 60 * 60
+# The share of the rate limit that polling leaves free for signing in and discovering systems
+ECOWATER_RATE_LIMIT_HEADROOM = 0.2
+
+ECOWATER_COLLECTOR_SOCKET_PATH = "/tmp/py_ecowater.sock"
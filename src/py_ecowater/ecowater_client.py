@@ -1,16 +1,46 @@
+import asyncio
+import concurrent.futures
+import contextlib
 import datetime
+import hashlib
+import random
+import re
+import threading
 import time
-from typing import Optional, List
+from typing import Optional, List, Dict
 
-import requests as r
 import logging
 from . import constants
 from .constants import EcowaterConstants
 from .model import UserProfile, Devices, Systems, SystemState
+from .profiling import StageTimings
+from .subscription import Subscription
+from .transport import Transport, AsyncTransport, RequestsTransport, TransportResponse
+
+__all__ = ["EcowaterClient", "EcowaterConstants"]
+
+# Consecutive dashboard responses usually only differ in their deviceDate
+_DEVICE_DATE_PATTERN = re.compile(rb'"deviceDate"\s*:\s*"([^"]*)"')
+
+
+def _get_content_digest(content: bytes) -> bytes:
+    return hashlib.blake2b(_DEVICE_DATE_PATTERN.sub(b"", content), digest_size=16).digest()
+
+
+class _CachedResponse(object):
+    def __init__(self, value, digest: Optional[bytes], etag: Optional[str], last_modified: Optional[str]):
+        self.value = value
+        self.digest: Optional[bytes] = digest
+        self.etag: Optional[str] = etag
+        self.last_modified: Optional[str] = last_modified
 
 
 class EcowaterClient(object):
-    def __init__(self, username: str, password: str, host: Optional[str] = None):
+    def __init__(self, username: str, password: str, host: Optional[str] = None,
+                 transport: Optional[Transport] = None, auto_refresh: bool = False,
+                 async_transport: Optional[AsyncTransport] = None, profile: bool = False,
+                 reuse_unchanged_responses: bool = True,
+                 parse_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None):
         self.username: str = username
         self.password: str = password
         self.logger: logging.Logger = logging.getLogger("py_ecowater")
@@ -18,20 +48,95 @@ class EcowaterClient(object):
         self.auth_expiration: Optional[datetime.datetime] = None
         self.devices: Optional[Devices] = None
         self.ecowater_constants: EcowaterConstants = EcowaterConstants(host)
+        self.transport: Transport = transport if transport else RequestsTransport()
+        self.async_transport: Optional[AsyncTransport] = async_transport
+        self.timings: Optional[StageTimings] = StageTimings() if profile else None
+        self.reuse_unchanged_responses: bool = reuse_unchanged_responses
+        self.__responses: Dict[str, _CachedResponse] = {}
+        # Must be a thread pool, as the response is parsed together with the client's cache of previous responses,
+        # which cannot be sent to another process
+        if parse_executor is not None and not isinstance(parse_executor, concurrent.futures.ThreadPoolExecutor):
+            raise ValueError(f"parse_executor must be a ThreadPoolExecutor, not {type(parse_executor).__name__}")
+        self.parse_executor: Optional[concurrent.futures.ThreadPoolExecutor] = parse_executor
+        self.auto_refresh: bool = auto_refresh
+        self.__auth_lock: threading.Lock = threading.Lock()
+        self.__refresh_lock: threading.Lock = threading.Lock()
+        self.__refresh_thread: Optional[threading.Thread] = None
+        self.__refresh_timer: Optional[threading.Timer] = None
 
     def __authenticate(self) -> bool:
         if self.auth_token and self.auth_expiration:
-            auth_minutes_remaining = (self.auth_expiration - datetime.datetime.now()).total_seconds() / 60
-            if datetime.datetime.now() + datetime.timedelta(minutes=self.ecowater_constants.auth_expiry_buffer_minutes) > self.auth_expiration:
+            now = datetime.datetime.now()
+            auth_minutes_remaining = (self.auth_expiration - now).total_seconds() / 60
+
+            if now >= self.auth_expiration:
+                self.logger.info("The Auth token expired %s min ago, need to refresh", -auth_minutes_remaining)
+            elif now + datetime.timedelta(minutes=self.ecowater_constants.auth_expiry_buffer_minutes) > self.auth_expiration:
+                # The token is still valid, so keep using it while it is refreshed off the request path
                 self.logger.info(f"The Auth token expires in {auth_minutes_remaining} min, which shorter than the "
-                                 f"configured buffer of {self.ecowater_constants.auth_expiry_buffer_minutes} min, need to refresh")
-                self.auth_token = ""
-                self.auth_expiration = None
+                                 f"configured buffer of {self.ecowater_constants.auth_expiry_buffer_minutes} min, "
+                                 f"refreshing in the background")
+                self.__refresh_in_background()
+                return True
             else:
                 return True
         else:
             self.logger.info("Using credentials to fetch auth token")
 
+        with self.__auth_lock:
+            # Another thread may have signed in while we waited for the lock
+            if self.auth_token and self.auth_expiration and datetime.datetime.now() < self.auth_expiration:
+                return True
+
+            return self.__sign_in()
+
+    def __refresh_in_background(self):
+        with self.__refresh_lock:
+            if self.__refresh_thread and self.__refresh_thread.is_alive():
+                return
+
+            self.__refresh_thread = threading.Thread(target=self.__refresh, name="py_ecowater-auth-refresh",
+                                                     daemon=True)
+            self.__refresh_thread.start()
+
+    def __refresh(self):
+        with self.__auth_lock:
+            if not self.__sign_in() and self.auto_refresh:
+                self.__schedule_refresh(self.ecowater_constants.auth_refresh_retry_seconds)
+
+    def __schedule_refresh(self, delay_seconds: Optional[float] = None):
+        """Schedule a background sign-in ahead of the token expiring. Without an explicit delay, the refresh happens at
+        a random point in the ``auth_refresh_jitter_minutes`` before the expiry buffer, so that many clients that signed
+        in together do not all sign in again at the same moment."""
+        if delay_seconds is None:
+            if not self.auth_expiration:
+                return
+
+            refresh_at = self.auth_expiration - datetime.timedelta(
+                minutes=self.ecowater_constants.auth_expiry_buffer_minutes
+                + random.uniform(0, self.ecowater_constants.auth_refresh_jitter_minutes))
+            delay_seconds = max((refresh_at - datetime.datetime.now()).total_seconds(), 0)
+
+        with self.__refresh_lock:
+            if self.__refresh_timer:
+                self.__refresh_timer.cancel()
+
+            self.__refresh_timer = threading.Timer(delay_seconds, self.__refresh_in_background)
+            self.__refresh_timer.daemon = True
+            self.__refresh_timer.start()
+
+        self.logger.debug("Scheduled auth token refresh in %s seconds", delay_seconds)
+
+    def stop_auth_refresh(self):
+        """Cancel any scheduled background refresh of the auth token."""
+        self.auto_refresh = False
+
+        with self.__refresh_lock:
+            if self.__refresh_timer:
+                self.__refresh_timer.cancel()
+                self.__refresh_timer = None
+
+    def __sign_in(self) -> bool:
         body = {
             "username": self.username,
             "password": self.password
@@ -40,8 +145,9 @@ class EcowaterClient(object):
         url = ""
         try:
             url = f"{self.ecowater_constants.uri_base}{constants.ECOWATER_PATH_AUTH}"
-            headers = self.ecowater_constants.headers_auth
-            response = r.post(url, headers=headers, json=body)
+            headers = self.ecowater_constants.headers_auth.copy()
+            headers["accept-encoding"] = self.transport.accept_encoding
+            response = self.transport.request("POST", url, headers=headers, json=body)
         except Exception as e:
             self.logger.error("Unable to authenticate to %s: %s", url, e)
             return False
@@ -67,6 +173,8 @@ class EcowaterClient(object):
                 self.devices: Optional[Devices] = Devices(data["deviceMap"])
 
         if self.auth_token:
+            if self.auto_refresh:
+                self.__schedule_refresh()
             return True
         else:
             self.logger.error("Could not find auth token in response from auth endpoint")
@@ -85,34 +193,150 @@ class EcowaterClient(object):
     def get_system_state(self, serial_number: str):
         return self.__get_api(SystemState, serial_number=serial_number)
 
-    def __get_api(self, klass, **kwargs):
-        self.__authenticate()
+    def get_system_state_data(self, serial_number: str) -> Optional[dict]:
+        """Fetch the raw dashboard ``data`` dict for a system without building a `SystemState` from it. This is the
+        JSON-serializable form shared between processes by `EcowaterCollector`."""
+        data = self.__get_api_data(SystemState.get_path(serial_number=serial_number))
+        return data if data else None
 
+    def __get_api(self, klass, **kwargs):
         path = klass.get_path(**kwargs)
+        cached = self.__responses.get(path) if self.reuse_unchanged_responses else None
+
+        with self.__time("auth"):
+            self.__authenticate()
 
         url = ""
         try:
-            url = f"{self.ecowater_constants.uri_base}{path}"
-            headers = self.ecowater_constants.headers_api.copy()
-            headers["authorization"] = f"Bearer {self.auth_token}"
-
-            response = r.get(url, headers=headers)
+            url, headers = self.__get_request(path, self.transport.accept_encoding, cached)
+            with self.__time("transport"):
+                response = self.transport.request("GET", url, headers=headers)
         except Exception as e:
             self.logger.error("Unable to authenticate to %s: %s", url, e)
             return False
 
+        return self.__build_response(klass, path, response, cached)
+
+    def __get_api_data(self, path: str):
+        with self.__time("auth"):
+            self.__authenticate()
+
+        url = ""
+        try:
+            url, headers = self.__get_request(path, self.transport.accept_encoding)
+            with self.__time("transport"):
+                response = self.transport.request("GET", url, headers=headers)
+        except Exception as e:
+            self.logger.error("Unable to request %s: %s", url, e)
+            return False
+
+        return self.__get_response_data(response)
+
+    async def get_system_state_async(self, serial_number: str):
+        """Fetch the state of a system without blocking the event loop. Requests are sent with the client's
+        `async_transport` when it has one, and otherwise run in the default executor with the synchronous transport.
+        Responses are decoded and parsed on the client's `parse_executor` when it has one."""
+        loop = asyncio.get_running_loop()
+
+        if not self.async_transport:
+            return await loop.run_in_executor(None, self.get_system_state, serial_number)
+
+        with self.__time("auth"):
+            if not self.auth_token or not self.auth_expiration or datetime.datetime.now() >= self.auth_expiration:
+                # Signing in is blocking, so keep it off the event loop
+                await loop.run_in_executor(None, self.__authenticate)
+            else:
+                self.__authenticate()
+
+        path = SystemState.get_path(serial_number=serial_number)
+        cached = self.__responses.get(path) if self.reuse_unchanged_responses else None
+
+        url = ""
+        try:
+            url, headers = self.__get_request(path, self.async_transport.accept_encoding, cached)
+            with self.__time("transport"):
+                response = await self.async_transport.request("GET", url, headers=headers)
+        except Exception as e:
+            self.logger.error("Unable to request %s: %s", url, e)
+            return False
+
+        if self.parse_executor:
+            return await loop.run_in_executor(self.parse_executor, self.__build_response, SystemState, path, response,
+                                              cached)
+
+        return self.__build_response(SystemState, path, response, cached)
+
+    def subscribe(self, serial_numbers: List[str], **kwargs) -> Subscription:
+        """Poll the state of many systems and stream the results, for use with ``async for``. See `Subscription` for
+        the polling and backpressure options."""
+        return Subscription(self, serial_numbers, **kwargs)
+
+    def __time(self, stage: str):
+        return self.timings.time(stage) if self.timings else contextlib.nullcontext()
+
+    def __get_request(self, path: str, accept_encoding: str, cached: Optional[_CachedResponse] = None):
+        url = f"{self.ecowater_constants.uri_base}{path}"
+        headers = self.ecowater_constants.headers_api.copy()
+        headers["accept-encoding"] = accept_encoding
+        headers["authorization"] = f"Bearer {self.auth_token}"
+
+        if cached and cached.etag:
+            headers["if-none-match"] = cached.etag
+        if cached and cached.last_modified:
+            headers["if-modified-since"] = cached.last_modified
+
+        return url, headers
+
+    def __build_response(self, klass, path: str, response: TransportResponse, cached: Optional[_CachedResponse]):
+        """Build the model object for a response, or return the object built for the previous response of the same
+        path when the server says it is not modified or its content, apart from ``deviceDate``, is unchanged."""
+        if cached and response.status_code == 304:
+            return cached.value
+
+        digest = None
+        if self.reuse_unchanged_responses and response.status_code == 200:
+            with self.__time("dedup"):
+                digest = _get_content_digest(response.content)
+
+            if cached and cached.digest == digest:
+                device_date = _DEVICE_DATE_PATTERN.search(response.content)
+                if device_date and isinstance(cached.value, SystemState):
+                    cached.value = cached.value.with_device_date(device_date.group(1).decode())
+                cached.etag = response.headers.get("etag")
+                cached.last_modified = response.headers.get("last-modified")
+                return cached.value
+
+        data = self.__get_response_data(response)
+
+        if data is False:
+            return False
+
+        if data is None:
+            return None
+
+        with self.__time("build"):
+            value = klass(api=data)
+
+        if self.reuse_unchanged_responses:
+            self.__responses[path] = _CachedResponse(value, digest, response.headers.get("etag"),
+                                                     response.headers.get("last-modified"))
+
+        return value
+
+    def __get_response_data(self, response: TransportResponse):
         if response.status_code != 200:
             self.logger.error("Response code was %s: %s", response.status_code, response.reason)
             return False
 
         try:
-            response_json = response.json()
+            with self.__time("decode"):
+                response_json = response.json()
         except Exception as e:
             self.logger.error("Could not parse json from response: %s. %s", response.content, e)
             return False
 
         if "data" in response_json:
-            return klass(api=response_json["data"])
+            return response_json["data"]
         else:
             return None
 
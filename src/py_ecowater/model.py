@@ -1,13 +1,45 @@
+import collections
+import copy
 import logging
 import json
+import threading
 from datetime import datetime
 
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from . import constants
+from .units import NormalizedSystemState
 
 logger = logging.getLogger("py_ecowater")
 
+_parse_error_counts: collections.Counter = collections.Counter()
+_parse_error_counts_lock: threading.Lock = threading.Lock()
+
+
+def _record_parse_error(field: str):
+    with _parse_error_counts_lock:
+        _parse_error_counts[field] += 1
+
+
+def get_parse_error_counts() -> Dict[str, int]:
+    """Returns the number of fields that failed to parse in this process, keyed by ``<class>.<api field>``. A field that
+    starts failing usually means the API schema has changed."""
+    with _parse_error_counts_lock:
+        return dict(_parse_error_counts)
+
+
+def reset_parse_error_counts():
+    with _parse_error_counts_lock:
+        _parse_error_counts.clear()
+
+
+def _parse_device_date(value: str) -> datetime:
+    try:
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%fZ")
+    except ValueError:
+        # Fall back to other ISO 8601 forms, such as timestamps without fractional seconds
+        return datetime.fromisoformat(value[:-1] if value.endswith("Z") else value)
+
 
 class ApiResponse(object):
     """A base class object representing an API response."""
@@ -254,72 +286,70 @@ class SystemState(ApiResponseObject):
     def __init__(self, api: dict = None):
         super().__init__(api)
 
-        if api:
-            self.iron_level_tenths_ppm: IronLevelTenthsPpm = IronLevelTenthsPpm(api["ironLevelTenthsPpm"]) \
-                if "ironLevelTenthsPpm" in api else None
-            self.hardness_unit_enum: HardnessUnitEnum = HardnessUnitEnum(api["hardnessUnitEnum"]) \
-                if "hardnessUnitEnum" in api else None
-            self.hardness_grains: HardnessGrains = HardnessGrains(api["hardnessGrains"]) \
-                if "hardnessGrains" in api else None
-            self.salt_level_tenths: SaltLevelTenths = SaltLevelTenths(api["saltLevelTenths"]) \
-                if "saltLevelTenths" in api else None
-            self.salt_monitor_enum: SaltMonitorEnum = SaltMonitorEnum(api["saltMonitorEnum"]) \
-                if "saltMonitorEnum" in api else None
-            self.volume_unit_enum: VolumeUnitEnum = VolumeUnitEnum(api["volumeUnitEnum"]) \
-                if "volumeUnitEnum" in api else None
-            self.regen_enable_enum: RegenEnableEnum = RegenEnableEnum(api["regenEnableEnum"]) \
-                if "regenEnableEnum" in api else None
-            self.regen_time_secs: RegenTimeSecs = RegenTimeSecs(api["regenTimeSecs"]) \
-                if "regenTimeSecs" in api else None
-            self.time_format_enum: TimeFormatEnum = TimeFormatEnum(api["timeFormatEnum"]) \
-                if "timeFormatEnum" in api else None
-            self.time_zone_enum: TimeZoneEnum = TimeZoneEnum(api["timeZoneEnum"]) \
-                if "timeZoneEnum" in api else None
-            self.date_format_enum: DateFormatEnum = DateFormatEnum(api["dateFormatEnum"]) \
-                if "dateFormatEnum" in api else None
-            self.water_shutoff_valve_req: WaterShutoffValveReq = WaterShutoffValveReq(api["waterShutoffValveReq"]) \
-                if "waterShutoffValveReq" in api else None
-            self.total_water_available_gallons: TotalWaterAvailableGallons = TotalWaterAvailableGallons(api["totalWaterAvailGals"]) \
-                if "totalWaterAvailGals" in api else None
-            self.current_water_flow: CurrentWaterFlow = CurrentWaterFlow(api["currentWaterFlow"]) \
-                if "currentWaterFlow" in api else None
-            self.gallons_used_today: GallonsUsedToday = GallonsUsedToday(api["gallonsUsedToday"]) \
-                if "gallonsUsedToday" in api else None
-            self.average_daily_use_gallons: AverageDailyUseGallons = AverageDailyUseGallons(api["avgDailyUseGallons"]) \
-                if "avgDailyUseGallons" in api else None
-            self.regen_status_enum: RegenStatusEnum = RegenStatusEnum(api["regenStatusEnum"]) \
-                if "regenStatusEnum" in api else None
-            self.out_of_salt_estimated_days: OutOfSaltEstimatedDays = OutOfSaltEstimatedDays(api["outOfSaltEstDays"]) \
-                if "outOfSaltEstDays" in api else None
-            self.days_since_last_regen: DaysSinceLastRegen = DaysSinceLastRegen(api["daysSinceLastRegen"]) \
-                if "daysSinceLastRegen" in api else None
-            self.model_id: ModelId = ModelId(api["modelId"]) \
-                if "modelId" in api else None
-            self.model_description: ModelDescription = ModelDescription(api["modelDescription"]) \
-                if "modelDescription" in api else None
-            self.system_type: SystemType = SystemType(api["systemType"]) \
-                if "systemType" in api else None
-            self.water_shutoff_valve: WaterShutoffValve = WaterShutoffValve(api["waterShutoffValve"]) \
-                if "waterShutoffValve" in api else None
-            self.water_shutoff_valve_installed: WaterShutoffValveInstalled = WaterShutoffValveInstalled(api["waterShutoffValveInstalled"]) \
-                if "waterShutoffValveInstalled" in api else None
-            self.water_shutoff_valve_override: WaterShutoffValveOverride = WaterShutoffValveOverride(api["waterShutoffValveOverride"]) \
-                if "waterShutoffValveOverride" in api else None
-            self.water_shutoff_valve_device_action: WaterShutoffValveDeviceAction = WaterShutoffValveDeviceAction(api["waterShutoffValveDeviceAction"]) \
-                if "waterShutoffValveDeviceAction" in api else None
-            self.water_shutoff_valve_error_code: WaterShutoffValveErrorCode = WaterShutoffValveErrorCode(api["wsovErrorCode"]) \
-                if "wsovErrorCode" in api else None
-            self.base_software_version: BaseSoftwareVersion = BaseSoftwareVersion(api["baseSoftwareVersion"]) \
-                if "baseSoftwareVersion" in api else None
+        self.parse_errors: Dict[str, str] = {}
+
+        if api:
+            self.iron_level_tenths_ppm: IronLevelTenthsPpm = self.__parse(api, "ironLevelTenthsPpm", IronLevelTenthsPpm)
+            self.hardness_unit_enum: HardnessUnitEnum = self.__parse(api, "hardnessUnitEnum", HardnessUnitEnum)
+            self.hardness_grains: HardnessGrains = self.__parse(api, "hardnessGrains", HardnessGrains)
+            self.salt_level_tenths: SaltLevelTenths = self.__parse(api, "saltLevelTenths", SaltLevelTenths)
+            self.salt_monitor_enum: SaltMonitorEnum = self.__parse(api, "saltMonitorEnum", SaltMonitorEnum)
+            self.volume_unit_enum: VolumeUnitEnum = self.__parse(api, "volumeUnitEnum", VolumeUnitEnum)
+            self.regen_enable_enum: RegenEnableEnum = self.__parse(api, "regenEnableEnum", RegenEnableEnum)
+            self.regen_time_secs: RegenTimeSecs = self.__parse(api, "regenTimeSecs", RegenTimeSecs)
+            self.time_format_enum: TimeFormatEnum = self.__parse(api, "timeFormatEnum", TimeFormatEnum)
+            self.time_zone_enum: TimeZoneEnum = self.__parse(api, "timeZoneEnum", TimeZoneEnum)
+            self.date_format_enum: DateFormatEnum = self.__parse(api, "dateFormatEnum", DateFormatEnum)
+            self.water_shutoff_valve_req: WaterShutoffValveReq = self.__parse(api, "waterShutoffValveReq", WaterShutoffValveReq)
+            self.total_water_available_gallons: TotalWaterAvailableGallons = self.__parse(api, "totalWaterAvailGals", TotalWaterAvailableGallons)
+            self.current_water_flow: CurrentWaterFlow = self.__parse(api, "currentWaterFlow", CurrentWaterFlow)
+            self.gallons_used_today: GallonsUsedToday = self.__parse(api, "gallonsUsedToday", GallonsUsedToday)
+            self.average_daily_use_gallons: AverageDailyUseGallons = self.__parse(api, "avgDailyUseGallons", AverageDailyUseGallons)
+            self.regen_status_enum: RegenStatusEnum = self.__parse(api, "regenStatusEnum", RegenStatusEnum)
+            self.out_of_salt_estimated_days: OutOfSaltEstimatedDays = self.__parse(api, "outOfSaltEstDays", OutOfSaltEstimatedDays)
+            self.days_since_last_regen: DaysSinceLastRegen = self.__parse(api, "daysSinceLastRegen", DaysSinceLastRegen)
+            self.model_id: ModelId = self.__parse(api, "modelId", ModelId)
+            self.model_description: ModelDescription = self.__parse(api, "modelDescription", ModelDescription)
+            self.system_type: SystemType = self.__parse(api, "systemType", SystemType)
+            self.water_shutoff_valve: WaterShutoffValve = self.__parse(api, "waterShutoffValve", WaterShutoffValve)
+            self.water_shutoff_valve_installed: WaterShutoffValveInstalled = self.__parse(api, "waterShutoffValveInstalled", WaterShutoffValveInstalled)
+            self.water_shutoff_valve_override: WaterShutoffValveOverride = self.__parse(api, "waterShutoffValveOverride", WaterShutoffValveOverride)
+            self.water_shutoff_valve_device_action: WaterShutoffValveDeviceAction = self.__parse(api, "waterShutoffValveDeviceAction", WaterShutoffValveDeviceAction)
+            self.water_shutoff_valve_error_code: WaterShutoffValveErrorCode = self.__parse(api, "wsovErrorCode", WaterShutoffValveErrorCode)
+            self.base_software_version: BaseSoftwareVersion = self.__parse(api, "baseSoftwareVersion", BaseSoftwareVersion)
             self.power: str = api["power"] if "power" in api else None
-            try:
-                self.device_date: datetime = datetime.strptime(api["deviceDate"], "%Y-%m-%dT%H:%M:%S.%fZ") \
-                    if "deviceDate" in api else None
-            except ValueError:
-                logger.error("Unable to parse deviceDate string ('%s') as datetime", api["deviceDate"])
-                self.device_date = None
-            self.refresh_policy: RefreshPolicy = RefreshPolicy(api["refreshPolicy"]) \
-                if "refreshPolicy" in api else None
+            self.device_date: datetime = self.__parse(api, "deviceDate", _parse_device_date)
+            self.refresh_policy: RefreshPolicy = self.__parse(api, "refreshPolicy", RefreshPolicy)
+
+        try:
+            self.normalized: NormalizedSystemState = NormalizedSystemState(self)
+        except Exception as e:
+            logger.error("Unable to normalize SystemState values: %s", e)
+            self.parse_errors["normalized"] = f"{type(e).__name__}: {e}"
+            _record_parse_error("SystemState.normalized")
+            self.normalized = None
+
+    def with_device_date(self, device_date: str) -> "SystemState":
+        """Returns a shallow copy of a system state whose other values have not changed, with a new device date. The
+        system state itself is left untouched, as it may already have been returned to a caller."""
+        system_state = copy.copy(self)
+        system_state.parse_errors = {k: v for k, v in self.parse_errors.items() if k != "deviceDate"}
+        system_state.device_date = system_state.__parse({"deviceDate": device_date}, "deviceDate", _parse_device_date)
+        return system_state
+
+    def __parse(self, api: dict, key: str, parse):
+        """Parse a single field of the API response, so that an unexpected value only loses that field rather than the
+        whole system state. Failures are recorded in `parse_errors` and counted by `get_parse_error_counts`."""
+        if key not in api:
+            return None
+
+        try:
+            return parse(api[key])
+        except Exception as e:
+            logger.error("Unable to parse SystemState field %s ('%s'): %s", key, api[key], e)
+            self.parse_errors[key] = f"{type(e).__name__}: {e}"
+            _record_parse_error(f"SystemState.{key}")
+            return None
 
 
 
@@ -0,0 +1,93 @@
+import asyncio
+import concurrent.futures
+import json
+import logging
+from typing import Optional, List, Union
+
+from .model import SystemState
+
+__all__ = ["SystemStatePayload", "parse_system_state", "parse_system_states", "parse_system_states_async"]
+
+logger = logging.getLogger("py_ecowater")
+
+SystemStatePayload = Union[bytes, str, dict]
+
+
+def parse_system_state(payload: SystemStatePayload) -> Optional[SystemState]:
+    """Build a `SystemState` from a dashboard response body, either raw JSON or an already decoded dict, with or
+    without the ``data`` wrapper of the API response. Returns None if the payload cannot be decoded.
+    Parameters
+    ----------
+    payload : `bytes`, `str` or `dict`
+        The dashboard response.
+    """
+    if isinstance(payload, (bytes, bytearray, str)):
+        try:
+            payload = json.loads(payload)
+        except Exception as e:
+            logger.error("Could not parse json from system state payload: %s", e)
+            return None
+
+    if not isinstance(payload, dict):
+        logger.error("System state payload is not an object: %s", payload)
+        return None
+
+    return SystemState(api=payload["data"] if "data" in payload else payload)
+
+
+def _parse_chunk(payloads: List[SystemStatePayload]) -> List[Optional[SystemState]]:
+    return [parse_system_state(payload) for payload in payloads]
+
+
+def _chunk(payloads: List[SystemStatePayload], chunk_size: int) -> List[List[SystemStatePayload]]:
+    return [payloads[i:i + chunk_size] for i in range(0, len(payloads), chunk_size)]
+
+
+def parse_system_states(payloads: List[SystemStatePayload], executor: Optional[concurrent.futures.Executor] = None,
+                        max_workers: Optional[int] = None, use_processes: bool = False,
+                        chunk_size: int = 32) -> List[Optional[SystemState]]:
+    """Decode and build many `SystemState` objects on a thread or process pool, returned in the order of the payloads.
+    Payloads are sent to the pool in chunks to amortize the cost of handing work to it. A process pool parses in
+    parallel, but `get_parse_error_counts` only counts the errors of the process it is called in.
+    Parameters
+    ----------
+    payloads : `list`
+        Dashboard responses, as accepted by `parse_system_state`.
+    executor : `Executor`
+        The pool to parse with. If not given, a pool is created for this call.
+    max_workers : `int`
+        The number of workers of the pool created when no executor is given.
+    use_processes : `bool`
+        Whether the pool created when no executor is given uses processes rather than threads.
+    chunk_size : `int`
+        The number of payloads handed to a worker at a time.
+    """
+    payloads = list(payloads)
+    chunks = _chunk(payloads, chunk_size)
+
+    if executor:
+        return [state for states in executor.map(_parse_chunk, chunks) for state in states]
+
+    pool_class = concurrent.futures.ProcessPoolExecutor if use_processes else concurrent.futures.ThreadPoolExecutor
+    with pool_class(max_workers=max_workers) as pool:
+        return [state for states in pool.map(_parse_chunk, chunks) for state in states]
+
+
+async def parse_system_states_async(payloads: List[SystemStatePayload],
+                                    executor: Optional[concurrent.futures.Executor] = None,
+                                    chunk_size: int = 32) -> List[Optional[SystemState]]:
+    """Like `parse_system_states`, but awaits the pool so that the event loop keeps serving network I/O while the
+    payloads are parsed. Uses the loop's default executor when no executor is given.
+    Parameters
+    ----------
+    payloads : `list`
+        Dashboard responses, as accepted by `parse_system_state`.
+    executor : `Executor`
+        The thread or process pool to parse with.
+    chunk_size : `int`
+        The number of payloads handed to a worker at a time.
+    """
+    loop = asyncio.get_running_loop()
+    chunks = _chunk(list(payloads), chunk_size)
+    results = await asyncio.gather(*[loop.run_in_executor(executor, _parse_chunk, chunk) for chunk in chunks])
+    return [state for states in results for state in states]
@@ -0,0 +1,54 @@
+import collections
+import contextlib
+import threading
+import time
+from typing import Dict
+
+__all__ = ["StageTimings"]
+
+
+class StageTimings(object):
+    """Accumulates how long each stage of a request takes, such as ``auth``, ``transport`` (sending the request and
+    reading and decompressing the response), ``dedup`` (hashing the response to detect unchanged ones), ``decode``
+    (JSON decoding) and ``build`` (constructing the model objects)."""
+
+    def __init__(self):
+        self.__counts: Dict[str, int] = collections.Counter()
+        self.__totals: Dict[str, float] = collections.defaultdict(float)
+        self.__maximums: Dict[str, float] = collections.defaultdict(float)
+        self.__lock: threading.Lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        with self.__lock:
+            self.__counts[stage] += 1
+            self.__totals[stage] += seconds
+            self.__maximums[stage] = max(self.__maximums[stage], seconds)
+
+    @contextlib.contextmanager
+    def time(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def reset(self):
+        with self.__lock:
+            self.__counts.clear()
+            self.__totals.clear()
+            self.__maximums.clear()
+
+    def summary(self) -> dict:
+        """Returns the count, total, mean and maximum time of each stage, and each stage's share of the total time."""
+        with self.__lock:
+            total = sum(self.__totals.values())
+            return {
+                stage: {
+                    "count": count,
+                    "total_seconds": self.__totals[stage],
+                    "mean_ms": self.__totals[stage] / count * 1000,
+                    "max_ms": self.__maximums[stage] * 1000,
+                    "percent": self.__totals[stage] / total * 100 if total else None,
+                }
+                for stage, count in self.__counts.items()
+            }
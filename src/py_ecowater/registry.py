@@ -0,0 +1,206 @@
+import collections
+import logging
+import threading
+from typing import Optional, List, Dict, Set
+
+from .model import Devices, Device, Systems, System
+
+__all__ = ["SystemRegistryChanges", "SystemRegistry"]
+
+logger = logging.getLogger("py_ecowater")
+
+
+def _fingerprint(obj) -> int:
+    # Only a hash is kept per system, so that change detection does not double the memory of the registry
+    return hash(repr(_fields(obj)))
+
+
+def _fields(obj):
+    return [(k, _fields(v) if hasattr(v, "__dict__") else v) for k, v in sorted(vars(obj).items())]
+
+
+class SystemRegistryChanges(object):
+    """The serial numbers of the systems a `SystemRegistry` update added, changed and removed."""
+
+    def __init__(self):
+        self.added: List[str] = []
+        self.changed: List[str] = []
+        self.removed: List[str] = []
+
+    def __bool__(self):
+        return bool(self.added or self.changed or self.removed)
+
+
+class SystemRegistry(object):
+    """Merges the `Systems` and `Devices` of many accounts into indexes by serial number, id, model, system type and
+    account. Updating an account only touches the index entries of systems that were added, changed or removed, and
+    the least recently updated systems are evicted once ``max_systems`` is reached. A system shared by several accounts
+    is kept until the last of them no longer returns it.
+    Parameters
+    ----------
+    max_systems : `int`
+        The maximum number of systems to keep. Defaults to no limit. Devices are kept per account and are not bounded
+        by it; use `remove_account` to drop an account's systems and devices.
+    """
+
+    def __init__(self, max_systems: Optional[int] = None):
+        self.max_systems: Optional[int] = max_systems
+        self.__systems: collections.OrderedDict = collections.OrderedDict()
+        self.__fingerprints: Dict[str, int] = {}
+        self.__accounts: Dict[str, Set[str]] = {}
+        self.__serial_numbers_by_id: Dict[str, str] = {}
+        self.__by_model: Dict[str, Set[str]] = collections.defaultdict(set)
+        self.__by_system_type: Dict[str, Set[str]] = collections.defaultdict(set)
+        self.__by_account: Dict[str, Set[str]] = collections.defaultdict(set)
+        self.__devices: Dict[str, Dict[int, Device]] = {}
+        self.__lock: threading.RLock = threading.RLock()
+
+    def __len__(self):
+        return len(self.__systems)
+
+    def __contains__(self, serial_number: str):
+        return serial_number in self.__systems
+
+    def __index(self, system: System):
+        serial_number = system.serial_number
+        self.__systems[serial_number] = system
+        self.__systems.move_to_end(serial_number)
+        self.__fingerprints[serial_number] = _fingerprint(system)
+        if system.id:
+            self.__serial_numbers_by_id[system.id] = serial_number
+        if system.model_description:
+            self.__by_model[system.model_description].add(serial_number)
+        if system.system_type:
+            self.__by_system_type[system.system_type].add(serial_number)
+
+    def __unindex(self, serial_number: str):
+        system = self.__systems.pop(serial_number)
+        del self.__fingerprints[serial_number]
+        if system.id and self.__serial_numbers_by_id.get(system.id) == serial_number:
+            del self.__serial_numbers_by_id[system.id]
+        if system.model_description:
+            _discard(self.__by_model, system.model_description, serial_number)
+        if system.system_type:
+            _discard(self.__by_system_type, system.system_type, serial_number)
+
+    def __remove(self, serial_number: str):
+        self.__unindex(serial_number)
+        for account in self.__accounts.pop(serial_number):
+            _discard(self.__by_account, account, serial_number)
+
+    def update(self, account: str, systems: Optional[Systems], devices: Optional[Devices] = None) \
+            -> SystemRegistryChanges:
+        """Replace the systems (and optionally devices) of an account with the latest results of `get_systems` and
+        `get_devices`.
+        Parameters
+        ----------
+        account : `str`
+            The account the results belong to, such as the client's username.
+        systems : `Systems`
+            The systems of the account.
+        devices : `Devices`
+            The devices of the account. Leaves the account's devices unchanged when None.
+        """
+        changes = SystemRegistryChanges()
+
+        with self.__lock:
+            if devices is not None:
+                self.__devices[account] = {device.id: device for device in devices.devices if hasattr(device, "id")}
+
+            if systems is None:
+                return changes
+
+            current = {system.serial_number: system for system in systems.systems
+                       if getattr(system, "serial_number", None)}
+
+            if self.max_systems and len(current) > self.max_systems:
+                logger.warning("Account %s has %s systems, more than the registry holds, keeping the first %s",
+                               account, len(current), self.max_systems)
+                current = dict(list(current.items())[:self.max_systems])
+
+            for serial_number in self.__by_account.get(account, set()) - set(current):
+                _discard(self.__by_account, account, serial_number)
+                self.__accounts[serial_number].discard(account)
+                if not self.__accounts[serial_number]:
+                    self.__remove(serial_number)
+                    changes.removed.append(serial_number)
+
+            for serial_number, system in current.items():
+                if serial_number not in self.__systems:
+                    self.__accounts[serial_number] = set()
+                    self.__index(system)
+                    changes.added.append(serial_number)
+                elif self.__fingerprints[serial_number] != _fingerprint(system):
+                    self.__unindex(serial_number)
+                    self.__index(system)
+                    changes.changed.append(serial_number)
+                else:
+                    self.__systems[serial_number] = system
+                    self.__systems.move_to_end(serial_number)
+
+                self.__accounts[serial_number].add(account)
+                self.__by_account[account].add(serial_number)
+
+            # The systems of this update were moved to the end, and there are at most max_systems of them, so only
+            # systems of other accounts are evicted
+            while self.max_systems and len(self.__systems) > self.max_systems:
+                serial_number = next(iter(self.__systems))
+                logger.debug("System registry is full, evicting %s", serial_number)
+                self.__remove(serial_number)
+                changes.removed.append(serial_number)
+
+        return changes
+
+    def remove_account(self, account: str) -> SystemRegistryChanges:
+        """Drop the devices of an account and its systems that no other account shares."""
+        with self.__lock:
+            self.__devices.pop(account, None)
+            return self.update(account, Systems())
+
+    def refresh(self, client) -> SystemRegistryChanges:
+        """Fetch the systems and devices of a client's account and update the registry with them."""
+        systems = client.get_systems()
+        return self.update(client.username, systems if systems else None, client.devices)
+
+    def get_by_serial_number(self, serial_number: str) -> Optional[System]:
+        return self.__systems.get(serial_number)
+
+    def get_by_id(self, system_id: str) -> Optional[System]:
+        with self.__lock:
+            serial_number = self.__serial_numbers_by_id.get(system_id)
+            return self.__systems.get(serial_number) if serial_number else None
+
+    def get_accounts(self, serial_number: str) -> List[str]:
+        """Returns the accounts a system belongs to."""
+        with self.__lock:
+            return sorted(self.__accounts.get(serial_number, ()))
+
+    def find_by_model(self, model_description: str) -> List[System]:
+        return self.__find(self.__by_model, model_description)
+
+    def find_by_system_type(self, system_type: str) -> List[System]:
+        return self.__find(self.__by_system_type, system_type)
+
+    def find_by_account(self, account: str) -> List[System]:
+        return self.__find(self.__by_account, account)
+
+    def get_devices(self, account: str) -> List[Device]:
+        with self.__lock:
+            return list(self.__devices.get(account, {}).values())
+
+    def get_device(self, account: str, device_id: int) -> Optional[Device]:
+        with self.__lock:
+            return self.__devices.get(account, {}).get(device_id)
+
+    def __find(self, index: Dict[str, Set[str]], key: str) -> List[System]:
+        with self.__lock:
+            return [self.__systems[serial_number] for serial_number in index.get(key, ())]
+
+
+def _discard(index: Dict[str, Set[str]], key: str, serial_number: str):
+    serial_numbers = index.get(key)
+    if serial_numbers is not None:
+        serial_numbers.discard(serial_number)
+        if not serial_numbers:
+            # Drop empty entries so that keys of evicted systems do not accumulate
+            del index[key]
@@ -0,0 +1,209 @@
+import asyncio
+import collections
+import heapq
+import itertools
+import logging
+import time
+from typing import Optional, List, Dict
+
+__all__ = ["SUBSCRIPTION_POLICIES", "SystemStateUpdate", "Subscription"]
+
+logger = logging.getLogger("py_ecowater")
+
+SUBSCRIPTION_POLICIES = ("block", "drop_oldest", "coalesce")
+
+
+class SystemStateUpdate(object):
+    """A system state received by a `Subscription`.
+    Parameters
+    ----------
+    serial_number : `str`
+        The serial number of the system.
+    system_state : `SystemState`
+        The state of the system.
+    received : `float`
+        The time the state was received, as a unix timestamp.
+    """
+
+    def __init__(self, serial_number: str, system_state, received: float):
+        self.serial_number: str = serial_number
+        self.system_state = system_state
+        self.received: float = received
+
+
+class Subscription(object):
+    """Polls the state of many systems and merges the results into a single stream of `SystemStateUpdate`, in the order
+    they were received. Polling is done by a fixed number of tasks however many systems there are, and each system is
+    polled as often as the server's refresh policy asks, within the given bounds, backing off when requests fail.
+
+    Updates wait in a bounded buffer until they are consumed. When the buffer is full, the ``policy`` decides what
+    happens: ``block`` pauses polling until the consumer catches up, ``drop_oldest`` discards the oldest update, and
+    ``coalesce`` keeps only the latest pending update for each system (and drops the oldest update when the buffer is
+    full of different systems).
+    Parameters
+    ----------
+    client : `EcowaterClient`
+        The client to poll with.
+    serial_numbers : `list`
+        The serial numbers of the systems to poll.
+    policy : `str`
+        One of ``block``, ``drop_oldest`` or ``coalesce``.
+    max_queue_size : `int`
+        The number of updates that can wait to be consumed.
+    concurrency : `int`
+        The number of requests in flight at once.
+    min_interval_seconds : `float`
+        The shortest time between polls of the same system.
+    max_interval_seconds : `float`
+        The longest time between polls of the same system.
+    budget : `RequestBudget`
+        An optional request budget shared by all polls, to stay within the API rate limit.
+    """
+
+    def __init__(self, client, serial_numbers: List[str], policy: str = "coalesce", max_queue_size: int = 1000,
+                 concurrency: int = 10, min_interval_seconds: float = 60, max_interval_seconds: float = 3600,
+                 budget=None):
+        if policy not in SUBSCRIPTION_POLICIES:
+            raise ValueError(f"Unknown subscription policy {policy}, must be one of {SUBSCRIPTION_POLICIES}")
+
+        self.client = client
+        self.serial_numbers: List[str] = list(serial_numbers)
+        self.policy: str = policy
+        self.max_queue_size: int = max_queue_size
+        self.concurrency: int = concurrency
+        self.min_interval_seconds: float = min_interval_seconds
+        self.max_interval_seconds: float = max_interval_seconds
+        self.budget = budget
+        self.dropped: int = 0
+        self.coalesced: int = 0
+        self.__pending: collections.OrderedDict = collections.OrderedDict()
+        self.__intervals: Dict[str, float] = {}
+        self.__schedule: list = []
+        self.__sequence = itertools.count()
+        self.__condition: Optional[asyncio.Condition] = None
+        self.__rescheduled: Optional[asyncio.Event] = None
+        self.__work: Optional[asyncio.Queue] = None
+        self.__tasks: List[asyncio.Task] = []
+        self.__closed: bool = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> SystemStateUpdate:
+        if self.__closed:
+            raise StopAsyncIteration
+
+        self.__start()
+
+        async with self.__condition:
+            while not self.__pending:
+                if self.__closed:
+                    raise StopAsyncIteration
+                await self.__condition.wait()
+
+            _, update = self.__pending.popitem(last=False)
+            self.__condition.notify_all()
+            return update
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+
+    async def aclose(self):
+        """Stop polling. Updates that have not been consumed are discarded."""
+        self.__closed = True
+
+        for task in self.__tasks:
+            task.cancel()
+        await asyncio.gather(*self.__tasks, return_exceptions=True)
+        self.__tasks = []
+
+        if self.__condition:
+            async with self.__condition:
+                self.__pending.clear()
+                self.__condition.notify_all()
+
+    def __start(self):
+        if self.__tasks:
+            return
+
+        # Created here rather than in __init__ so that they belong to the running event loop
+        self.__condition = asyncio.Condition()
+        self.__rescheduled = asyncio.Event()
+        self.__work = asyncio.Queue(maxsize=self.concurrency)
+
+        now = asyncio.get_running_loop().time()
+        self.__schedule = [(now, next(self.__sequence), serial_number) for serial_number in self.serial_numbers]
+        heapq.heapify(self.__schedule)
+
+        self.__tasks = [asyncio.ensure_future(self.__run_schedule())]
+        self.__tasks += [asyncio.ensure_future(self.__poll()) for _ in range(self.concurrency)]
+
+    def __reschedule(self, serial_number: str, delay_seconds: float):
+        due = asyncio.get_running_loop().time() + delay_seconds
+        heapq.heappush(self.__schedule, (due, next(self.__sequence), serial_number))
+        self.__rescheduled.set()
+
+    async def __run_schedule(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            delay = self.__schedule[0][0] - loop.time() if self.__schedule else None
+
+            if delay is None or delay > 0:
+                self.__rescheduled.clear()
+                try:
+                    await asyncio.wait_for(self.__rescheduled.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, serial_number = heapq.heappop(self.__schedule)
+            await self.__work.put(serial_number)
+
+    async def __poll(self):
+        while True:
+            serial_number = await self.__work.get()
+            interval = self.__intervals.get(serial_number, self.min_interval_seconds)
+
+            if self.budget and not self.budget.try_acquire():
+                logger.warning("Request budget exhausted, delaying poll of %s", serial_number)
+                self.__reschedule(serial_number, interval)
+                continue
+
+            try:
+                system_state = await self.client.get_system_state_async(serial_number)
+            except Exception as e:
+                logger.error("Unable to poll system state of %s: %s", serial_number, e)
+                system_state = None
+
+            if system_state:
+                refresh_policy = getattr(system_state, "refresh_policy", None)
+                interval = refresh_policy.time / 1000 if refresh_policy and refresh_policy.time else interval
+                await self.__publish(SystemStateUpdate(serial_number, system_state, time.time()))
+            else:
+                interval *= 2
+
+            interval = min(max(interval, self.min_interval_seconds), self.max_interval_seconds)
+            self.__intervals[serial_number] = interval
+            self.__reschedule(serial_number, interval)
+
+    async def __publish(self, update: SystemStateUpdate):
+        async with self.__condition:
+            if self.policy == "coalesce" and update.serial_number in self.__pending:
+                self.__pending[update.serial_number] = update
+                self.coalesced += 1
+                return
+
+            if len(self.__pending) >= self.max_queue_size:
+                if self.policy == "block":
+                    await self.__condition.wait_for(lambda: len(self.__pending) < self.max_queue_size)
+                else:
+                    self.__pending.popitem(last=False)
+                    self.dropped += 1
+
+            key = update.serial_number if self.policy == "coalesce" else next(self.__sequence)
+            self.__pending[key] = update
+            self.__condition.notify_all()
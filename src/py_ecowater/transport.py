@@ -0,0 +1,255 @@
+import json
+import logging
+import threading
+import zlib
+from typing import Optional
+
+import requests as r
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+__all__ = [
+    "ACCEPT_ENCODING", "HOP_BY_HOP_HEADERS", "decode_content", "TransportResponse", "TransportStats", "Transport",
+    "AsyncTransport", "RequestsTransport", "HttpxTransport", "AsyncHttpxTransport",
+]
+
+logger = logging.getLogger("py_ecowater")
+
+# Only advertise the encodings we are able to decode
+ACCEPT_ENCODING = "gzip, deflate, br" if brotli else "gzip, deflate"
+
+# Connection-specific headers are not allowed in HTTP/2 requests
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "proxy-connection", "transfer-encoding", "upgrade"}
+
+
+def decode_content(content: bytes, content_encoding: Optional[str]) -> bytes:
+    """Decode a response body as it was sent on the wire according to its ``content-encoding`` header.
+    Parameters
+    ----------
+    content : `bytes`
+        The response body as it was received.
+    content_encoding : `str`
+        The value of the ``content-encoding`` response header, if any.
+    """
+    if not content_encoding or not content:
+        return content
+
+    # Encodings are listed in the order they were applied, so undo them in reverse
+    for encoding in reversed([e.strip().lower() for e in content_encoding.split(",")]):
+        if encoding in ("", "identity"):
+            continue
+        elif encoding in ("gzip", "x-gzip"):
+            content = zlib.decompress(content, 16 + zlib.MAX_WBITS)
+        elif encoding == "deflate":
+            try:
+                content = zlib.decompress(content)
+            except zlib.error:
+                # Some servers send raw deflate data without the zlib wrapper
+                content = zlib.decompress(content, -zlib.MAX_WBITS)
+        elif encoding == "br":
+            if not brotli:
+                raise ValueError("Response is brotli encoded but neither brotli nor brotlicffi is installed")
+            content = brotli.decompress(content)
+        else:
+            raise ValueError(f"Unsupported content-encoding: {encoding}")
+
+    return content
+
+
+class TransportResponse(object):
+    """A decoded HTTP response returned by a `Transport`.
+    Parameters
+    ----------
+    status_code : `int`
+        The HTTP status code.
+    reason : `str`
+        The HTTP reason phrase.
+    headers : `dict`
+        The response headers, with lower case names.
+    content : `bytes`
+        The decoded response body.
+    wire_bytes : `int`
+        The size of the response body as it was received, before decoding.
+    http_version : `str`
+        The HTTP version the response was received with.
+    """
+
+    def __init__(self, status_code: int, reason: str, headers: dict, content: bytes, wire_bytes: int,
+                 http_version: str = "HTTP/1.1"):
+        self.status_code: int = status_code
+        self.reason: str = reason
+        self.headers: dict = headers
+        self.content: bytes = content
+        self.wire_bytes: int = wire_bytes
+        self.http_version: str = http_version
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class TransportStats(object):
+    """Counters of the requests made by a transport and the bytes of response bodies received on the wire and after
+    decoding."""
+
+    def __init__(self):
+        self.requests: int = 0
+        self.wire_bytes: int = 0
+        self.decoded_bytes: int = 0
+        self.__lock: threading.Lock = threading.Lock()
+
+    def record(self, response: TransportResponse):
+        with self.__lock:
+            self.requests += 1
+            self.wire_bytes += response.wire_bytes
+            self.decoded_bytes += len(response.content)
+
+    @property
+    def compression_ratio(self) -> Optional[float]:
+        return self.decoded_bytes / self.wire_bytes if self.wire_bytes else None
+
+
+class Transport(object):
+    """A base class for the synchronous HTTP transports used by `EcowaterClient`."""
+
+    accept_encoding: str = ACCEPT_ENCODING
+
+    def __init__(self):
+        self.stats: TransportStats = TransportStats()
+
+    def request(self, method: str, url: str, headers: dict, json: Optional[dict] = None) -> TransportResponse:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class AsyncTransport(object):
+    """A base class for asynchronous HTTP transports."""
+
+    accept_encoding: str = ACCEPT_ENCODING
+
+    def __init__(self):
+        self.stats: TransportStats = TransportStats()
+
+    async def request(self, method: str, url: str, headers: dict, json: Optional[dict] = None) -> TransportResponse:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class RequestsTransport(Transport):
+    """An HTTP/1.1 transport using a `requests` session, so the connection to the Ecowater host is kept alive between
+    requests."""
+
+    def __init__(self):
+        super().__init__()
+        self.session: r.Session = r.Session()
+
+    def request(self, method: str, url: str, headers: dict, json: Optional[dict] = None) -> TransportResponse:
+        response = self.session.request(method, url, headers=headers, json=json, stream=True)
+
+        try:
+            raw = response.raw.read(decode_content=False)
+        finally:
+            response.close()
+
+        transport_response = TransportResponse(
+            status_code=response.status_code,
+            reason=response.reason,
+            headers={k.lower(): v for k, v in response.headers.items()},
+            content=decode_content(raw, response.headers.get("content-encoding")),
+            wire_bytes=len(raw)
+        )
+        self.stats.record(transport_response)
+        return transport_response
+
+    def close(self):
+        self.session.close()
+
+
+def _httpx_headers(headers: dict) -> dict:
+    return {k: v for k, v in headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
+
+
+def _httpx_response(response, raw: bytes) -> TransportResponse:
+    return TransportResponse(
+        status_code=response.status_code,
+        reason=response.reason_phrase,
+        headers={k.lower(): v for k, v in response.headers.items()},
+        content=decode_content(raw, response.headers.get("content-encoding")),
+        wire_bytes=len(raw),
+        http_version=response.http_version
+    )
+
+
+class HttpxTransport(Transport):
+    """A transport using `httpx`, which multiplexes requests over a single HTTP/2 connection to the Ecowater host when
+    the ``h2`` package is installed. Install with ``pip install httpx[http2]``.
+    Parameters
+    ----------
+    http2 : `bool`
+        Whether to negotiate HTTP/2. Defaults to True when ``h2`` is installed.
+    """
+
+    def __init__(self, http2: Optional[bool] = None):
+        super().__init__()
+        if not httpx:
+            raise ImportError("HttpxTransport requires httpx, install it with `pip install httpx[http2]`")
+
+        self.client = httpx.Client(http2=bool(h2) if http2 is None else http2)
+
+    def request(self, method: str, url: str, headers: dict, json: Optional[dict] = None) -> TransportResponse:
+        with self.client.stream(method, url, headers=_httpx_headers(headers), json=json) as response:
+            raw = b"".join(response.iter_raw())
+
+        transport_response = _httpx_response(response, raw)
+        self.stats.record(transport_response)
+        return transport_response
+
+    def close(self):
+        self.client.close()
+
+
+class AsyncHttpxTransport(AsyncTransport):
+    """An asynchronous transport using `httpx`, which multiplexes concurrent requests over a single HTTP/2 connection
+    to the Ecowater host when the ``h2`` package is installed. Install with ``pip install httpx[http2]``.
+    Parameters
+    ----------
+    http2 : `bool`
+        Whether to negotiate HTTP/2. Defaults to True when ``h2`` is installed.
+    """
+
+    def __init__(self, http2: Optional[bool] = None):
+        super().__init__()
+        if not httpx:
+            raise ImportError("AsyncHttpxTransport requires httpx, install it with `pip install httpx[http2]`")
+
+        self.client = httpx.AsyncClient(http2=bool(h2) if http2 is None else http2)
+
+    async def request(self, method: str, url: str, headers: dict, json: Optional[dict] = None) -> TransportResponse:
+        async with self.client.stream(method, url, headers=_httpx_headers(headers), json=json) as response:
+            raw = b"".join([chunk async for chunk in response.aiter_raw()])
+
+        transport_response = _httpx_response(response, raw)
+        self.stats.record(transport_response)
+        return transport_response
+
+    async def close(self):
+        await self.client.aclose()
@@ -0,0 +1,134 @@
+import datetime
+import enum
+import logging
+from typing import Optional
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    try:
+        # zoneinfo was added in python 3.9
+        from backports.zoneinfo import ZoneInfo
+    except ImportError:
+        ZoneInfo = None
+
+__all__ = [
+    "LITERS_PER_GALLON", "PPM_PER_GRAIN_PER_GALLON", "VolumeUnit", "HardnessUnit", "TimeFormat",
+    "NormalizedSystemState",
+]
+
+logger = logging.getLogger("py_ecowater")
+
+LITERS_PER_GALLON = 3.785411784
+PPM_PER_GRAIN_PER_GALLON = 17.118
+
+
+class VolumeUnit(enum.IntEnum):
+    """The values of `VolumeUnitEnum`. 0 is gallons as in the documented responses, 1 is assumed to be liters."""
+    GALLONS = 0
+    LITERS = 1
+
+
+class HardnessUnit(enum.IntEnum):
+    """The values of `HardnessUnitEnum`. 0 is grains per gallon as in the documented responses, 1 is assumed to be
+    parts per million."""
+    GRAINS_PER_GALLON = 0
+    PARTS_PER_MILLION = 1
+
+
+class TimeFormat(enum.IntEnum):
+    """The values of `TimeFormatEnum`. 0 is 12 hour time as in the documented responses, 1 is assumed to be 24 hour."""
+    TWELVE_HOUR = 0
+    TWENTY_FOUR_HOUR = 1
+
+
+def _to_enum(enum_class, api_value) -> Optional[enum.Enum]:
+    value = api_value.value if api_value else None
+    if value is None:
+        return None
+
+    try:
+        return enum_class(value)
+    except ValueError:
+        logger.debug("Unknown %s value: %s", enum_class.__name__, value)
+        return None
+
+
+def _get_time_zone(name: Optional[str]) -> Optional[datetime.tzinfo]:
+    if not name or not ZoneInfo:
+        return None
+
+    try:
+        return ZoneInfo(name)
+    except Exception as e:
+        logger.warning("Unknown time zone %s: %s", name, e)
+        return None
+
+
+class NormalizedSystemState(object):
+    """The values of a `SystemState` converted into plain units, computed once when the system state is parsed.
+    Volumes are reported by the API in the unit of ``volume_unit_enum`` and are converted to both gallons and liters.
+    Values that are missing from the system state are None.
+    Parameters
+    ----------
+    system_state : `SystemState`
+        The parsed system state to normalize.
+    """
+
+    def __init__(self, system_state):
+        s = system_state
+
+        self.volume_unit: Optional[VolumeUnit] = _to_enum(VolumeUnit, getattr(s, "volume_unit_enum", None))
+        self.hardness_unit: Optional[HardnessUnit] = _to_enum(HardnessUnit, getattr(s, "hardness_unit_enum", None))
+        self.time_format: Optional[TimeFormat] = _to_enum(TimeFormat, getattr(s, "time_format_enum", None))
+        time_zone_enum = getattr(s, "time_zone_enum", None)
+        self.time_zone: Optional[datetime.tzinfo] = _get_time_zone(time_zone_enum.value if time_zone_enum else None)
+
+        iron_level = _value(s, "iron_level_tenths_ppm")
+        self.iron_level_ppm: Optional[float] = iron_level / 10 if iron_level is not None else None
+
+        hardness = _value(s, "hardness_grains")
+        if hardness is None:
+            self.hardness_grains_per_gallon: Optional[float] = None
+            self.hardness_ppm: Optional[float] = None
+        elif self.hardness_unit == HardnessUnit.PARTS_PER_MILLION:
+            self.hardness_grains_per_gallon = hardness / PPM_PER_GRAIN_PER_GALLON
+            self.hardness_ppm = float(hardness)
+        else:
+            self.hardness_grains_per_gallon = float(hardness)
+            self.hardness_ppm = hardness * PPM_PER_GRAIN_PER_GALLON
+
+        salt_level = _value(s, "salt_level_tenths")
+        self.salt_level: Optional[float] = salt_level / 10 if salt_level is not None else None
+        salt_level_tenths = getattr(s, "salt_level_tenths", None)
+        self.salt_level_percent: Optional[int] = salt_level_tenths.percent \
+            if salt_level_tenths and hasattr(salt_level_tenths, "percent") else None
+
+        regen_time_secs = _value(s, "regen_time_secs")
+        self.regen_time: Optional[datetime.time] = None
+        if regen_time_secs is not None:
+            minutes, seconds = divmod(regen_time_secs % 86400, 60)
+            hours, minutes = divmod(minutes, 60)
+            self.regen_time = datetime.time(hours, minutes, seconds, tzinfo=self.time_zone)
+
+        to_gallons = 1 / LITERS_PER_GALLON if self.volume_unit == VolumeUnit.LITERS else 1.0
+        self.total_water_available_gallons, self.total_water_available_liters = \
+            _volumes(_value(s, "total_water_available_gallons"), to_gallons)
+        self.current_water_flow_gallons_per_minute, self.current_water_flow_liters_per_minute = \
+            _volumes(_value(s, "current_water_flow"), to_gallons)
+        self.used_today_gallons, self.used_today_liters = _volumes(_value(s, "gallons_used_today"), to_gallons)
+        self.average_daily_use_gallons, self.average_daily_use_liters = \
+            _volumes(_value(s, "average_daily_use_gallons"), to_gallons)
+
+
+def _value(system_state, name: str):
+    api_value = getattr(system_state, name, None)
+    return getattr(api_value, "value", None) if api_value else None
+
+
+def _volumes(value, to_gallons: float):
+    if value is None:
+        return None, None
+
+    gallons = value * to_gallons
+    return gallons, gallons * LITERS_PER_GALLON